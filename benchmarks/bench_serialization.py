@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Serialization Benchmark
+
+Compares encode/decode time and file size of the available JSON backends and
+columnar export formats on a synthetic activities dataset.
+
+Usage:
+    python benchmarks/bench_serialization.py [--activities 50000] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import strava_data_fetcher as fetcher
+
+ACTIVITY_TYPES = ['Ride', 'Run', 'Swim', 'Walk', 'Hike']
+
+def make_activities(count, seed=42):
+    """Build a list of synthetic activities shaped like the Strava activity list"""
+    rng = random.Random(seed)
+    start = datetime(2012, 1, 1)
+    activities = []
+    for i in range(count):
+        date = start + timedelta(hours=i * 3)
+        distance = rng.uniform(1000, 120000)
+        moving_time = int(distance / rng.uniform(1.5, 11))
+        activities.append({
+            'id': 1000000000 + i,
+            'name': f"Activity {i}",
+            'type': rng.choice(ACTIVITY_TYPES),
+            'start_date': date.isoformat() + 'Z',
+            'start_date_local': date.isoformat() + 'Z',
+            'distance': distance,
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + rng.randint(0, 1800),
+            'total_elevation_gain': rng.uniform(0, 2500),
+            'average_speed': distance / moving_time,
+            'max_speed': distance / moving_time * rng.uniform(1.2, 2.5),
+            'average_heartrate': rng.uniform(110, 175),
+            'max_heartrate': rng.uniform(160, 200),
+            'average_watts': rng.uniform(120, 300),
+            'average_cadence': rng.uniform(70, 95),
+            'kudos_count': rng.randint(0, 50),
+            'start_latlng': [rng.uniform(45, 48), rng.uniform(6, 11)],
+            'map': {
+                'id': f"a{i}",
+                'summary_polyline': ''.join(chr(rng.randint(63, 126)) for _ in range(rng.randint(100, 400)))
+            }
+        })
+    return activities
+
+def best_of(func, repeat):
+    """Return the best wall-clock time of several runs of func"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    """Run the serialization benchmark and print a results table"""
+    parser = argparse.ArgumentParser(description='Benchmark serialization backends')
+    parser.add_argument('--activities', type=int, help='Number of synthetic activities', default=50000)
+    parser.add_argument('--repeat', type=int, help='Runs per measurement (best is reported)', default=3)
+    args = parser.parse_args()
+
+    activities = make_activities(args.activities)
+    print(f"{args.activities} synthetic activities, best of {args.repeat} runs")
+    print(f"{'format':<16}{'encode (s)':>12}{'decode (s)':>12}{'size (MB)':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in fetcher.available_json_backends():
+            path = os.path.join(tmp, f"activities.{backend}.json")
+            encode = best_of(lambda: fetcher.dump_json(activities, path, backend=backend), args.repeat)
+            decode = best_of(lambda: fetcher.load_json(path, backend=backend), args.repeat)
+            size = os.path.getsize(path) / 1e6
+            print(f"{backend:<16}{encode:>12.3f}{decode:>12.3f}{size:>12.2f}")
+
+        for fmt in fetcher.EXPORT_FORMATS:
+            path = os.path.join(tmp, f"activities.{fmt}")
+            encode = best_of(lambda: fetcher.export_activities(activities, fmt, path), args.repeat)
+            if not os.path.exists(path):
+                print(f"{fmt:<16}{'not available':>36}")
+                continue
+
+            if fmt == 'parquet':
+                import pyarrow.parquet as pq
+                decode = best_of(lambda: pq.read_table(path), args.repeat)
+            else:
+                import numpy as np
+                decode = best_of(lambda: dict(np.load(path)), args.repeat)
+            size = os.path.getsize(path) / 1e6
+            print(f"{fmt:<16}{encode:>12.3f}{decode:>12.3f}{size:>12.2f}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+
+Measures how long it takes to import strava_data_fetcher and to answer a
+query from a synthetic snapshot, and checks that networking code is not
+imported on the query path. Exits with status 1 when a limit is exceeded,
+so it can be used to catch startup regressions.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 10] [--max-query-ms 150] [--max-import-ms 50]
+"""
+
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'strava_data_fetcher.py')
+
+# Modules that must stay out of the query path
+HEAVY_MODULES = ['requests', 'orjson', 'ujson', 'concurrent.futures', 'numpy', 'pyarrow']
+
+def make_snapshot(directory):
+    """Write a synthetic snapshot into directory/data using the fetcher itself"""
+    code = f"""
+import sys
+sys.path.insert(0, {ROOT!r})
+import strava_data_fetcher as fetcher
+years = {{}}
+for year in range(2012, 2027):
+    years[str(year)] = {{
+        'distance': 5000.0, 'elevation_gain': 50000.0, 'moving_time': 250.0, 'count': 300,
+        'activity_types': {{t: {{'distance': 1000.0, 'elevation_gain': 10000.0, 'moving_time': 50.0, 'count': 60}}
+                           for t in ('ride', 'run', 'swim', 'walk', 'hike')}}
+    }}
+summary = {{
+    'last_updated': '2026-01-01T00:00:00',
+    'years': years,
+    'totals': {{'distance': 75000.0, 'elevation_gain': 750000.0, 'moving_time': 3750.0, 'count': 4500}},
+    'activity_types': {{}},
+    'current_year': '2026'
+}}
+fetcher.write_snapshot(summary, {{}})
+"""
+    os.makedirs(os.path.join(directory, 'data'), exist_ok=True)
+    subprocess.run([sys.executable, '-c', code], cwd=directory, check=True)
+
+def best_run_ms(command, cwd, repeat):
+    """Return the best wall-clock time in milliseconds of running command"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+def import_time_ms(cwd):
+    """Return the cumulative import time of strava_data_fetcher from -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import strava_data_fetcher'],
+        cwd=cwd, env=dict(os.environ, PYTHONPATH=ROOT), check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| strava_data_fetcher$', line)
+        if match:
+            return int(match.group(1)) / 1000
+    return None
+
+def loaded_heavy_modules(cwd):
+    """List heavy modules loaded after running a query in-process"""
+    code = f"""
+import sys
+sys.path.insert(0, {ROOT!r})
+sys.argv = ['strava_data_fetcher.py', 'query', 'year']
+import strava_data_fetcher
+strava_data_fetcher.main()
+print('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+    result = subprocess.run([sys.executable, '-c', code], cwd=cwd, check=True, stdout=subprocess.PIPE, text=True)
+    loaded = [line for line in result.stdout.splitlines() if line.startswith('loaded:')][-1]
+    return [m for m in loaded[len('loaded:'):].split(',') if m]
+
+def main():
+    """Run the startup benchmark and print the results"""
+    parser = argparse.ArgumentParser(description='Benchmark CLI startup and query time')
+    parser.add_argument('--repeat', type=int, help='Runs per measurement (best is reported)', default=10)
+    parser.add_argument('--max-query-ms', type=float, help='Fail if a query takes longer than this', default=None)
+    parser.add_argument('--max-import-ms', type=float, help='Fail if importing the module takes longer than this', default=None)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        make_snapshot(tmp)
+
+        interpreter = best_run_ms([sys.executable, '-c', 'pass'], tmp, args.repeat)
+        query = best_run_ms([sys.executable, SCRIPT, 'query', 'year'], tmp, args.repeat)
+        module_import = import_time_ms(tmp)
+        heavy = loaded_heavy_modules(tmp)
+
+    print(f"{'interpreter startup':<24}{interpreter:>10.1f} ms")
+    print(f"{'module import':<24}{module_import:>10.1f} ms")
+    print(f"{'query year':<24}{query:>10.1f} ms")
+    print(f"{'query overhead':<24}{query - interpreter:>10.1f} ms")
+    print(f"{'heavy modules loaded':<24}{', '.join(heavy) or 'none':>10}")
+
+    if heavy:
+        print(f"FAIL: query imported {', '.join(heavy)}")
+        failed = True
+    if args.max_query_ms is not None and query > args.max_query_ms:
+        print(f"FAIL: query took {query:.1f} ms (limit {args.max_query_ms} ms)")
+        failed = True
+    if args.max_import_ms is not None and module_import > args.max_import_ms:
+        print(f"FAIL: import took {module_import:.1f} ms (limit {args.max_import_ms} ms)")
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,39 +13,158 @@ Requirements:
 Usage:
 1. Set up environment variables or config file with Strava API credentials
 2. Run the script: python strava_data_fetcher.py
+3. Answer quick questions from the last run: python strava_data_fetcher.py query year
 """
 
 import os
 import sys
 import json
 import time
+import math
+import pickle
 import argparse
+import importlib
 import logging
+import threading
+from collections import Counter
+from itertools import accumulate
 from datetime import datetime, timedelta
-import requests
-from pathlib import Path
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("strava_fetcher.log"),
-        logging.StreamHandler()
-    ]
-)
+
+class LazyModule:
+    """Module proxy that defers the actual import until an attribute is first used"""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Networking is only needed for full runs, so keep it out of query startup
+requests = LazyModule('requests')
+
+LOG_FILE = "strava_fetcher.log"
 logger = logging.getLogger("strava_fetcher")
 
+def configure_logging(log_file=LOG_FILE):
+    """Configure logging to the console and, for full runs, the log file"""
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
 # Constants
 CONFIG_FILE = "strava_config.json"
 TOKEN_FILE = "strava_token.json"
 DATA_DIR = "data"
 ACTIVITIES_FILE = f"{DATA_DIR}/activities.json"
 SEGMENTS_FILE = f"{DATA_DIR}/segments.json"
+SEGMENT_CACHE_FILE = f"{DATA_DIR}/segment_cache.json"
 ACHIEVEMENTS_FILE = f"{DATA_DIR}/achievements.json"
 ATHLETE_FILE = f"{DATA_DIR}/athlete.json"
 SUMMARY_FILE = f"{DATA_DIR}/summary.json"
 FEATURED_ACTIVITIES_FILE = f"{DATA_DIR}/featured_activities.json"
+HEATMAP_DIR = f"{DATA_DIR}/heatmap"
+HEATMAP_STATE_FILE = f"{HEATMAP_DIR}/state.json"
+HEATMAP_TILES_FILE = f"{HEATMAP_DIR}/tiles_z{{zoom}}.json"
+SKETCHES_FILE = f"{DATA_DIR}/sketches.json"
+EXPORT_FILE = f"{DATA_DIR}/activities.{{ext}}"
+SNAPSHOT_FILE = f"{DATA_DIR}/snapshot.pkl"
+SNAPSHOT_VERSION = 1
+
+# Questions answered by the query command from the snapshot
+QUERIES = ['year', 'totals', 'month', 'week', 'records', 'quantiles']
+
+# Segment enrichment settings
+SEGMENT_FETCH_WORKERS = 4  # Concurrent segment lookups
+STRAVA_RATE_LIMITS = [100, 1000]  # Read requests per 15 minutes and per day, counted until Strava reports usage
+RATE_LIMIT_HEADERS = ['X-RateLimit', 'X-ReadRateLimit']  # Overall and read-only limit header prefixes
+RATE_LIMIT_RESERVE = 2  # Requests left unused by segment lookups
+SEGMENT_REQUEST_INTERVAL = 0.05  # Minimum seconds between segment request starts, guards against bursts
+SEGMENT_FORBIDDEN_TTL = 7 * 24 * 3600  # Seconds before a segment that returned 403 is tried again
+SEGMENT_METADATA_FIELDS = [
+    'distance',
+    'average_grade',
+    'maximum_grade',
+    'elevation_high',
+    'elevation_low',
+    'total_elevation_gain',
+    'climb_category',
+    'start_latlng',
+    'end_latlng',
+    'city',
+    'state',
+    'country'
+]
+
+# Heatmap settings
+HEATMAP_ZOOMS = [4, 8, 12, 14]  # Web Mercator zoom levels to aggregate
+HEATMAP_BATCH_SIZE = 500  # Activities decoded per batch, bounds memory held at once
+MAX_MERCATOR_LAT = 85.05112878
+
+# Quantile sketch settings
+SKETCH_FIELDS = [
+    'average_speed',
+    'max_speed',
+    'average_heartrate',
+    'max_heartrate',
+    'average_watts',
+    'weighted_average_watts',
+    'average_cadence'
+]
+SKETCH_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+SKETCH_COMPRESSION = 100
+
+# Activity fields exported to columnar formats. Missing values are stored as:
+# - int columns: null in parquet (nullable int64), -1 in npz (EXPORT_MISSING_INT)
+# - float columns: null in parquet, NaN in npz
+# - str columns: null in parquet, '' in npz
+EXPORT_COLUMNS = {
+    'id': int,
+    'type': str,
+    'start_date_local': str,
+    'distance': float,
+    'moving_time': int,
+    'elapsed_time': int,
+    'total_elevation_gain': float,
+    'average_speed': float,
+    'max_speed': float,
+    'average_heartrate': float,
+    'max_heartrate': float,
+    'average_watts': float,
+    'weighted_average_watts': float,
+    'average_cadence': float,
+    'kudos_count': int
+}
+EXPORT_MISSING_INT = -1
+EXPORT_FORMATS = ['parquet', 'npz']
+
+def _load_orjson():
+    import orjson
+    return (lambda data: orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+
+def _load_ujson():
+    import ujson
+    return (lambda data: ujson.dumps(data).encode('utf-8'), ujson.loads)
+
+def _load_stdlib_json():
+    return (lambda data: json.dumps(data, separators=(',', ':')).encode('utf-8'), json.loads)
+
+# JSON serializer backends, fastest first: name -> loader returning (dumps to bytes, loads from bytes)
+# Backends are imported on first use to keep startup fast
+JSON_BACKENDS = {
+    'orjson': _load_orjson,
+    'ujson': _load_ujson,
+    'json': _load_stdlib_json
+}
+json_backend = None  # Selected backend name, defaults to the fastest installed one
+_json_backend_cache = {}
 
 # Strava API endpoints
 AUTH_URL = "https://www.strava.com/oauth/token"
@@ -55,6 +174,333 @@ ACTIVITY_URL = "https://www.strava.com/api/v3/activities/{id}"
 SEGMENTS_URL = "https://www.strava.com/api/v3/segments/{id}"
 SEGMENT_EFFORTS_URL = "https://www.strava.com/api/v3/segment_efforts/{id}"
 
+def get_json_backend(name=None):
+    """Return the (dumps, loads) pair of a JSON backend, importing it on first use"""
+    global json_backend
+    if name is None:
+        if json_backend is None:
+            json_backend = available_json_backends()[0]
+        name = json_backend
+    
+    if name not in _json_backend_cache:
+        if name not in JSON_BACKENDS:
+            raise ValueError(f"Unknown JSON backend '{name}' (expected one of: {', '.join(JSON_BACKENDS)})")
+        try:
+            _json_backend_cache[name] = JSON_BACKENDS[name]()
+        except ImportError:
+            raise ValueError(f"JSON backend '{name}' is not installed")
+    return _json_backend_cache[name]
+
+def available_json_backends():
+    """List the installed JSON backends, fastest first"""
+    names = []
+    for name in JSON_BACKENDS:
+        try:
+            get_json_backend(name)
+            names.append(name)
+        except ValueError:
+            pass
+    return names
+
+def set_json_backend(name):
+    """Select the JSON backend used by load_json and dump_json"""
+    global json_backend
+    get_json_backend(name)
+    json_backend = name
+
+def load_json(path, backend=None):
+    """Load JSON data from a file using the selected backend"""
+    loads = get_json_backend(backend)[1]
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+def dump_json(data, path, backend=None):
+    """Write data to a JSON file atomically using the selected backend"""
+    dumps = get_json_backend(backend)[0]
+    
+    # Every output (data files, token, caches) goes through here, so write to a temp
+    # file and swap it in; readers and interrupted runs never see a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(dumps(data))
+    os.replace(temp_path, path)
+
+def write_snapshot(summary, records):
+    """Write the small aggregate state used by the query command"""
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'summary': summary,
+        'records': records
+    }
+    
+    # Swap the finished file into place so queries never read a partial snapshot
+    temp_file = f"{SNAPSHOT_FILE}.tmp"
+    with open(temp_file, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, SNAPSHOT_FILE)
+    logger.info("Successfully wrote query snapshot")
+
+def load_snapshot():
+    """Load the aggregate state written by the last full run"""
+    if not os.path.exists(SNAPSHOT_FILE):
+        return None
+    
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, OSError, AttributeError, ValueError, ImportError) as e:
+        logger.error(f"Error loading snapshot: {e}")
+        return None
+    
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+def build_activity_columns(activities):
+    """Build a column-oriented table of activity fields, using None for missing values"""
+    columns = {name: [] for name in EXPORT_COLUMNS}
+    for activity in activities:
+        for name, column in columns.items():
+            column.append(activity.get(name))
+    return columns
+
+def export_activities(activities, fmt, path=None):
+    """Export the activity table to a columnar format (parquet or npz)"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}' (expected one of: {', '.join(EXPORT_FORMATS)})")
+    path = path or EXPORT_FILE.format(ext=fmt)
+    columns = build_activity_columns(activities)
+    
+    if fmt == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            logger.error("Parquet export requires pyarrow (pip install pyarrow)")
+            return None
+        
+        types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+        table = pa.table({
+            name: pa.array(values, type=types[EXPORT_COLUMNS[name]])
+            for name, values in columns.items()
+        })
+        pq.write_table(table, path)
+    else:
+        try:
+            import numpy as np
+        except ImportError:
+            logger.error("NPZ export requires numpy (pip install numpy)")
+            return None
+        
+        arrays = {}
+        for name, values in columns.items():
+            column_type = EXPORT_COLUMNS[name]
+            if column_type is float:
+                arrays[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            elif column_type is int:
+                arrays[name] = np.array([EXPORT_MISSING_INT if v is None else v for v in values], dtype=np.int64)
+            else:
+                arrays[name] = np.array(['' if v is None else v for v in values], dtype=np.str_)
+        np.savez_compressed(path, **arrays)
+    
+    logger.info(f"Successfully exported {len(activities)} activities to {path}")
+    return path
+
+def decode_polyline(encoded):
+    """Decode a Google encoded polyline into parallel lists of latitudes and longitudes"""
+    # Decode all varint deltas in a single pass, then rebuild coordinates with running sums
+    deltas = []
+    result = 0
+    shift = 0
+    for char in encoded:
+        b = ord(char) - 63
+        result |= (b & 0x1f) << shift
+        if b < 0x20:
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+            result = 0
+            shift = 0
+        else:
+            shift += 5
+    
+    lats = [v * 1e-5 for v in accumulate(deltas[0::2])]
+    lngs = [v * 1e-5 for v in accumulate(deltas[1::2])]
+    count = min(len(lats), len(lngs))
+    return lats[:count], lngs[:count]
+
+def project_mercator(lats, lngs):
+    """Project coordinates to normalized Web Mercator x/y in the range [0, 1)"""
+    xs = [(lng + 180.0) / 360.0 for lng in lngs]
+    ys = []
+    for lat in lats:
+        lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+        ys.append(0.5 - math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) / (2 * math.pi))
+    return xs, ys
+
+def _bin_polylines_numpy(np, polylines, zoom):
+    """Vectorized bin_polylines: decode and project a whole batch with array operations"""
+    data = np.frombuffer(''.join(polylines).encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    ends = data < 0x20
+    
+    # Each varint starts at the first character or right after the end of the previous one
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    positions = np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))
+    values = np.add.reduceat((data & 0x1f) << (5 * positions), starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+    
+    # Pair up lat/lng deltas per polyline, dropping a trailing unpaired value like decode_polyline
+    lengths = np.array([len(encoded) for encoded in polylines])
+    value_counts = np.add.reduceat(ends, np.concatenate(([0], np.cumsum(lengths)[:-1])))
+    pair_counts = value_counts // 2
+    keep = np.arange(len(values)) - np.repeat(np.cumsum(value_counts) - value_counts, value_counts) < np.repeat(pair_counts * 2, value_counts)
+    deltas = values[keep].reshape(-1, 2)
+    
+    # Running sums restart at each polyline
+    sums = np.cumsum(deltas, axis=0)
+    bases = np.vstack(([[0, 0]], sums))[np.cumsum(pair_counts) - pair_counts]
+    coords = (sums - np.repeat(bases, pair_counts, axis=0)) * 1e-5
+    
+    n = 1 << zoom
+    lats = np.radians(np.clip(coords[:, 0], -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    xs = (coords[:, 1] + 180.0) / 360.0
+    ys = 0.5 - np.log(np.tan(math.pi / 4 + lats / 2)) / (2 * math.pi)
+    tile_xs = np.minimum((xs * n).astype(np.int64), n - 1)
+    tile_ys = np.minimum((ys * n).astype(np.int64), n - 1)
+    
+    keys, counts = np.unique(tile_xs * n + tile_ys, return_counts=True)
+    return Counter(dict(zip(zip((keys // n).tolist(), (keys % n).tolist()), counts.tolist())))
+
+def bin_polylines(polylines, zoom):
+    """Decode a batch of polylines and count the points in each tile at a zoom level"""
+    # Use numpy when installed; it needs every polyline to end on a complete value so
+    # the batch can be decoded as one string
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None and polylines and all(p.isascii() and ord(p[-1]) - 63 < 0x20 for p in polylines):
+        return _bin_polylines_numpy(np, polylines, zoom)
+    
+    n = 1 << zoom
+    counts = Counter()
+    for encoded in polylines:
+        xs, ys = project_mercator(*decode_polyline(encoded))
+        counts.update(zip(
+            [min(int(x * n), n - 1) for x in xs],
+            [min(int(y * n), n - 1) for y in ys]
+        ))
+    return counts
+
+class TDigest:
+    """Mergeable t-digest sketch for streaming quantile estimates"""
+    
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        """Initialize an empty digest with the given compression factor"""
+        self.compression = compression
+        self.centroids = []  # Sorted list of [mean, weight]
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._buffer = []
+    
+    def update(self, value, weight=1):
+        """Add a single value to the digest"""
+        self._buffer.append([value, weight])
+        self.count += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) > self.compression * 5:
+            self._compress()
+    
+    def merge(self, other):
+        """Merge another digest into this one"""
+        if other.min is None:
+            return self
+        self._buffer.extend([mean, weight] for mean, weight in other.centroids)
+        self._buffer.extend([mean, weight] for mean, weight in other._buffer)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+        return self
+    
+    def _compress(self):
+        """Fold buffered values into centroids, keeping the tails small"""
+        points = sorted(self.centroids + self._buffer)
+        self._buffer = []
+        if not points:
+            return
+        
+        total = sum(weight for _, weight in points)
+        merged = [list(points[0])]
+        cumulative = 0
+        for mean, weight in points[1:]:
+            last = merged[-1]
+            q = (cumulative + last[1] + weight / 2) / total
+            limit = 4 * total * q * (1 - q) / self.compression
+            if last[1] + weight <= limit:
+                last[1] += weight
+                last[0] += (mean - last[0]) * weight / last[1]
+            else:
+                cumulative += last[1]
+                merged.append([mean, weight])
+        
+        self.centroids = merged
+        self.count = total
+    
+    def quantile(self, q):
+        """Estimate the value at quantile q (0-1)"""
+        self._compress()
+        if not self.centroids:
+            return None
+        
+        target = q * self.count
+        cumulative = 0
+        prev_mean, prev_center = self.min, 0
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target <= center:
+                if center == prev_center:
+                    return mean
+                return prev_mean + (mean - prev_mean) * (target - prev_center) / (center - prev_center)
+            cumulative += weight
+            prev_mean, prev_center = mean, center
+        
+        if self.count == prev_center:
+            return self.max
+        return prev_mean + (self.max - prev_mean) * (target - prev_center) / (self.count - prev_center)
+    
+    def to_dict(self):
+        """Serialize the digest to a JSON-compatible dict"""
+        self._compress()
+        return {
+            'compression': self.compression,
+            'min': self.min,
+            'max': self.max,
+            'centroids': self.centroids
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a digest from its serialized dict"""
+        digest = cls(compression=data.get('compression', SKETCH_COMPRESSION))
+        digest.centroids = [list(c) for c in data.get('centroids', [])]
+        digest.count = sum(weight for _, weight in digest.centroids)
+        digest.min = data.get('min')
+        digest.max = data.get('max')
+        return digest
+
+def merge_sketches(*sketch_sets):
+    """Merge several {type: {year: {field: TDigest}}} sketch sets, e.g. from different athletes"""
+    merged = {}
+    for sketches in sketch_sets:
+        for activity_type, years in sketches.items():
+            for year, fields in years.items():
+                for field, digest in fields.items():
+                    target = merged.setdefault(activity_type, {}).setdefault(year, {})
+                    if field not in target:
+                        target[field] = TDigest(compression=digest.compression)
+                    target[field].merge(digest)
+    return merged
+
 class StravaFetcher:
     """Class to handle Strava API authentication and data fetching"""
     
@@ -65,6 +511,12 @@ class StravaFetcher:
         self.config = self._load_config()
         self.token_data = self._load_token()
         self.headers = None
+        self._rate_limit_lock = threading.Lock()
+        self._next_request_time = 0
+        self.request_count = 0
+        self.rate_limits = {}  # Header prefix -> (limits, usage) from the latest response
+        self.rate_limited = False
+        self._requests_in_flight = 0
         
         # Ensure data directory exists
         os.makedirs(DATA_DIR, exist_ok=True)
@@ -73,8 +525,7 @@ class StravaFetcher:
         """Load configuration from file or environment variables"""
         if os.path.exists(self.config_file):
             try:
-                with open(self.config_file, 'r') as f:
-                    return json.load(f)
+                return load_json(self.config_file)
             except Exception as e:
                 logger.error(f"Error loading config file: {e}")
         
@@ -97,8 +548,7 @@ class StravaFetcher:
         """Load token data from file if it exists"""
         if os.path.exists(self.token_file):
             try:
-                with open(self.token_file, 'r') as f:
-                    return json.load(f)
+                return load_json(self.token_file)
             except Exception as e:
                 logger.error(f"Error loading token file: {e}")
         
@@ -108,8 +558,7 @@ class StravaFetcher:
     def _save_token(self):
         """Save token data to file"""
         try:
-            with open(self.token_file, 'w') as f:
-                json.dump(self.token_data, f)
+            dump_json(self.token_data, self.token_file)
         except Exception as e:
             logger.error(f"Error saving token file: {e}")
     
@@ -155,12 +604,12 @@ class StravaFetcher:
         """Get athlete profile data"""
         try:
             response = requests.get(ATHLETE_URL, headers=self.headers)
+            self._record_response(response)
             response.raise_for_status()
             athlete_data = response.json()
             
             # Save athlete data
-            with open(ATHLETE_FILE, 'w') as f:
-                json.dump(athlete_data, f)
+            dump_json(athlete_data, ATHLETE_FILE)
             
             logger.info("Successfully fetched athlete data")
             return athlete_data
@@ -181,6 +630,7 @@ class StravaFetcher:
                     'per_page': per_page
                 }
                 response = requests.get(ACTIVITIES_URL, headers=self.headers, params=params)
+                self._record_response(response)
                 response.raise_for_status()
                 activities = response.json()
                 
@@ -201,8 +651,7 @@ class StravaFetcher:
                 break
         
         # Save activities data
-        with open(ACTIVITIES_FILE, 'w') as f:
-            json.dump(all_activities, f)
+        dump_json(all_activities, ACTIVITIES_FILE)
         
         logger.info(f"Successfully fetched {len(all_activities)} activities")
         return all_activities
@@ -211,6 +660,7 @@ class StravaFetcher:
         """Get detailed information for a specific activity"""
         try:
             response = requests.get(ACTIVITY_URL.format(id=activity_id), headers=self.headers)
+            self._record_response(response)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -221,6 +671,7 @@ class StravaFetcher:
         """Get detailed information for a specific segment"""
         try:
             response = requests.get(SEGMENTS_URL.format(id=segment_id), headers=self.headers)
+            self._record_response(response)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -245,8 +696,7 @@ class StravaFetcher:
                 time.sleep(1)  # Respect rate limits
         
         # Save featured activities
-        with open(FEATURED_ACTIVITIES_FILE, 'w') as f:
-            json.dump(featured_activities, f)
+        dump_json(featured_activities, FEATURED_ACTIVITIES_FILE)
         
         logger.info(f"Successfully fetched {len(featured_activities)} featured activities")
         return featured_activities
@@ -288,14 +738,328 @@ class StravaFetcher:
                 segment['efforts'].sort(key=lambda x: x['date'], reverse=True)
                 segment['last_time'] = segment['efforts'][0]['elapsed_time']
         
+        # Join cached segment metadata and per-effort pace/VAM
+        metadata = self.enrich_segments(list(segment_efforts))
+        for segment_id, segment in segment_efforts.items():
+            details = metadata.get(str(segment_id))
+            if not details or 'unavailable' in details:
+                continue
+            
+            segment.update(details)
+            distance = details.get('distance') or 0
+            climb = details.get('total_elevation_gain')
+            if climb is None and details.get('elevation_high') is not None and details.get('elevation_low') is not None:
+                climb = max(details['elevation_high'] - details['elevation_low'], 0)
+            
+            for effort in segment['efforts']:
+                elapsed_time = effort['elapsed_time']
+                if not elapsed_time:
+                    continue
+                if distance:
+                    effort['pace'] = elapsed_time / (distance / 1000)  # Seconds per km
+                    effort['speed'] = distance / elapsed_time  # Meters per second
+                if climb:
+                    effort['vam'] = climb * 3600 / elapsed_time  # Vertical meters per hour
+        
         # Convert to list and save
         segments_list = list(segment_efforts.values())
-        with open(SEGMENTS_FILE, 'w') as f:
-            json.dump(segments_list, f)
+        dump_json(segments_list, SEGMENTS_FILE)
         
         logger.info(f"Successfully processed {len(segments_list)} segments")
         return segments_list
     
+    def _record_response(self, response):
+        """Count an API request and note the rate limit usage Strava reports"""
+        with self._rate_limit_lock:
+            self.request_count += 1
+            if response.status_code == 429:
+                self.rate_limited = True
+            for prefix in RATE_LIMIT_HEADERS:
+                try:
+                    # Headers are "<15 minute>,<daily>", e.g. "100,1000"
+                    limit = [int(v) for v in response.headers[f"{prefix}-Limit"].split(',')]
+                    usage = [int(v) for v in response.headers[f"{prefix}-Usage"].split(',')]
+                except (KeyError, ValueError):
+                    continue
+                self.rate_limits[prefix] = (limit, usage)
+    
+    def remaining_requests(self):
+        """Estimate how many API requests are left in the current rate limit windows"""
+        if self.rate_limited:
+            return 0
+        
+        # All requests made here are reads, so this run's count against the default read
+        # limits is always a bound; Strava's overall and read headers tighten it further
+        remaining = [limit - self.request_count for limit in STRAVA_RATE_LIMITS]
+        for limits, usage in self.rate_limits.values():
+            remaining.extend(limit - used for limit, used in zip(limits, usage))
+        return min(remaining)
+    
+    def _reserve_request(self):
+        """Claim one request from the remaining budget, counting requests other workers have in flight"""
+        with self._rate_limit_lock:
+            if self.remaining_requests() - self._requests_in_flight <= RATE_LIMIT_RESERVE:
+                return False
+            self._requests_in_flight += 1
+            return True
+    
+    def _release_request(self):
+        """Return a claimed request once its response has been recorded"""
+        with self._rate_limit_lock:
+            self._requests_in_flight -= 1
+    
+    def _wait_for_rate_limit(self):
+        """Block until the next request slot, spacing request starts across worker threads"""
+        with self._rate_limit_lock:
+            now = time.monotonic()
+            wait = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + SEGMENT_REQUEST_INTERVAL
+        if wait > 0:
+            time.sleep(wait)
+    
+    def _fetch_segment_metadata(self, segment_id):
+        """Fetch a segment's dashboard metadata, or an 'unavailable' marker if it can never be fetched"""
+        # Re-check the budget before every call, and stop working through the queue
+        # once it is used up or Strava has rejected a request
+        self._wait_for_rate_limit()
+        if not self._reserve_request():
+            return None
+        
+        try:
+            response = requests.get(SEGMENTS_URL.format(id=segment_id), headers=self.headers)
+            self._record_response(response)
+            response.raise_for_status()
+            segment = response.json()
+        except requests.exceptions.RequestException as e:
+            # A deleted segment (404) never comes back, so it is cached for good. A 403 may
+            # only mean the token lacks read_all, so it is retried after a while in case
+            # the user re-authorizes. Anything else is retried next run
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if status in (403, 404):
+                logger.info(f"Segment {segment_id} is unavailable (HTTP {status})")
+                return {'unavailable': status, 'checked_at': int(time.time())}
+            logger.error(f"Error fetching segment {segment_id}: {e}")
+            return None
+        finally:
+            self._release_request()
+        
+        return {field: segment.get(field) for field in SEGMENT_METADATA_FIELDS}
+    
+    def enrich_segments(self, segment_ids):
+        """Fetch metadata for segments not yet in the persistent cache"""
+        cache = {}
+        if os.path.exists(SEGMENT_CACHE_FILE):
+            try:
+                cache = load_json(SEGMENT_CACHE_FILE)
+            except Exception as e:
+                logger.error(f"Error loading segment cache: {e}")
+        
+        # Segments almost never change, so only unknown ids and expired negative entries are fetched
+        now = time.time()
+        new_ids = [
+            segment_id for segment_id in segment_ids
+            if str(segment_id) not in cache
+            or (cache[str(segment_id)].get('unavailable') not in (None, 404)
+                and now - cache[str(segment_id)].get('checked_at', 0) > SEGMENT_FORBIDDEN_TTL)
+        ]
+        if not new_ids:
+            return cache
+        
+        # Budget from what this run (or Strava's headers) says is left in the window
+        budget = max(self.remaining_requests() - RATE_LIMIT_RESERVE, 0)
+        if len(new_ids) > budget:
+            logger.info(f"{len(new_ids)} new segments, fetching {budget} within the rate limit this run")
+            new_ids = new_ids[:budget]
+        
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with ThreadPoolExecutor(max_workers=SEGMENT_FETCH_WORKERS) as executor:
+            results = list(executor.map(self._fetch_segment_metadata, new_ids))
+        
+        if self.remaining_requests() <= RATE_LIMIT_RESERVE:
+            logger.warning("Strava rate limit reached, remaining segments will be fetched next run")
+        
+        # Transient failures are left out of the cache and retried next run;
+        # unavailable segments are cached as negative entries
+        fetched = 0
+        unavailable = 0
+        for segment_id, metadata in zip(new_ids, results):
+            if metadata:
+                cache[str(segment_id)] = metadata
+                if 'unavailable' in metadata:
+                    unavailable += 1
+                else:
+                    fetched += 1
+        
+        dump_json(cache, SEGMENT_CACHE_FILE)
+        
+        logger.info(f"Successfully fetched metadata for {fetched} new segments ({unavailable} unavailable)")
+        return cache
+    
+    def _load_heatmap_tiles(self, zoom, generation):
+        """Load tile counts for a zoom level as a Counter keyed by (x, y), or None if they don't match the state"""
+        tiles_file = HEATMAP_TILES_FILE.format(zoom=zoom)
+        if not os.path.exists(tiles_file):
+            return None
+        
+        try:
+            tiles = load_json(tiles_file)
+        except Exception as e:
+            logger.error(f"Error loading heatmap tiles for zoom {zoom}: {e}")
+            return None
+        
+        if tiles.get('generation', 0) != generation:
+            return None
+        return Counter(dict(zip(zip(tiles['x'], tiles['y']), tiles['count'])))
+    
+    def aggregate_heatmap(self, activities):
+        """Bin activity summary polylines into per-zoom heatmap tile counts"""
+        os.makedirs(HEATMAP_DIR, exist_ok=True)
+        
+        # Load state of previous runs so only new activities are decoded
+        state = None
+        if os.path.exists(HEATMAP_STATE_FILE):
+            try:
+                state = load_json(HEATMAP_STATE_FILE)
+            except Exception as e:
+                logger.error(f"Error loading heatmap state: {e}")
+        
+        # Tiles are only reused if they were written by the same run as the state;
+        # otherwise they may already contain activities the state doesn't list
+        tiles = None
+        if state is not None and state.get('zooms') == HEATMAP_ZOOMS:
+            generation = state.get('generation', 0)
+            tiles = {zoom: self._load_heatmap_tiles(zoom, generation) for zoom in HEATMAP_ZOOMS}
+            if any(counts is None for counts in tiles.values()):
+                tiles = None
+        
+        if tiles is None:
+            if state is not None:
+                logger.info("Heatmap state doesn't match tiles, rebuilding all tiles")
+            state = {'zooms': HEATMAP_ZOOMS, 'generation': 0, 'activity_ids': []}
+            tiles = {zoom: Counter() for zoom in HEATMAP_ZOOMS}
+        
+        processed_ids = set(state['activity_ids'])
+        new_activities = [
+            a for a in activities
+            if a.get('id') not in processed_ids and (a.get('map') or {}).get('summary_polyline')
+        ]
+        
+        if not new_activities:
+            logger.info("No new activities for heatmap")
+            return tiles
+        
+        # Decode in batches so only one batch of coordinates is held in memory. Points are
+        # binned once at the deepest zoom; coarser tiles are derived from those counts
+        max_zoom = max(HEATMAP_ZOOMS)
+        point_count = 0
+        for start in range(0, len(new_activities), HEATMAP_BATCH_SIZE):
+            batch = new_activities[start:start + HEATMAP_BATCH_SIZE]
+            counts = bin_polylines([a['map']['summary_polyline'] for a in batch], max_zoom)
+            processed_ids.update(a['id'] for a in batch)
+            
+            for zoom in HEATMAP_ZOOMS:
+                shift = max_zoom - zoom
+                if shift == 0:
+                    tiles[zoom].update(counts)
+                    continue
+                zoom_tiles = tiles[zoom]
+                for (x, y), count in counts.items():
+                    zoom_tiles[(x >> shift, y >> shift)] += count
+            point_count += sum(counts.values())
+        
+        # Save sparse tile arrays per zoom level, then the state last, both tagged with
+        # a new generation so an interrupted save is detected on the next run
+        generation = state.get('generation', 0) + 1
+        for zoom, counts in tiles.items():
+            keys = sorted(counts)
+            dump_json({
+                'zoom': zoom,
+                'generation': generation,
+                'x': [k[0] for k in keys],
+                'y': [k[1] for k in keys],
+                'count': [counts[k] for k in keys]
+            }, HEATMAP_TILES_FILE.format(zoom=zoom))
+        
+        state['generation'] = generation
+        state['activity_ids'] = sorted(processed_ids)
+        dump_json(state, HEATMAP_STATE_FILE)
+        
+        logger.info(f"Successfully added {point_count} points from {len(new_activities)} activities to heatmap")
+        return tiles
+    
+    def update_sketches(self, activities):
+        """Add new activities to the persisted per-type, per-year quantile sketches"""
+        state = {'activity_ids': [], 'sketches': {}}
+        if os.path.exists(SKETCHES_FILE):
+            try:
+                state = load_json(SKETCHES_FILE)
+            except Exception as e:
+                logger.error(f"Error loading sketches file: {e}")
+        
+        sketches = {
+            activity_type: {
+                year: {field: TDigest.from_dict(data) for field, data in fields.items()}
+                for year, fields in years.items()
+            }
+            for activity_type, years in state['sketches'].items()
+        }
+        processed_ids = set(state['activity_ids'])
+        
+        new_count = 0
+        for activity in activities:
+            if activity.get('id') in processed_ids or 'start_date_local' not in activity:
+                continue
+            
+            year = activity['start_date_local'].split('-')[0]
+            activity_type = activity.get('type', 'other').lower()
+            fields = sketches.setdefault(activity_type, {}).setdefault(year, {})
+            
+            for field in SKETCH_FIELDS:
+                value = activity.get(field)
+                if value:  # Zero means the metric wasn't recorded
+                    if field not in fields:
+                        fields[field] = TDigest()
+                    fields[field].update(value)
+            
+            processed_ids.add(activity['id'])
+            new_count += 1
+        
+        # Save sketches
+        state = {
+            'activity_ids': sorted(processed_ids),
+            'sketches': {
+                activity_type: {
+                    year: {field: digest.to_dict() for field, digest in fields.items()}
+                    for year, fields in years.items()
+                }
+                for activity_type, years in sketches.items()
+            }
+        }
+        dump_json(state, SKETCHES_FILE)
+        
+        logger.info(f"Successfully added {new_count} activities to quantile sketches")
+        return sketches
+    
+    def calculate_distributions(self, sketches):
+        """Read quantiles for each type and year (plus all years combined) from sketches"""
+        distributions = {}
+        for activity_type, years in sketches.items():
+            distributions[activity_type] = {}
+            
+            # Merge the per-year digests to get the all-time distribution
+            all_years = merge_sketches(*({activity_type: {'all': fields}} for fields in years.values()))
+            
+            for year, fields in list(years.items()) + list(all_years[activity_type].items()):
+                distributions[activity_type][year] = {}
+                for field, digest in fields.items():
+                    stats = {'count': digest.count, 'min': digest.min, 'max': digest.max}
+                    for q in SKETCH_QUANTILES:
+                        stats[f"p{int(q * 100)}"] = digest.quantile(q)
+                    distributions[activity_type][year][field] = stats
+        
+        return distributions
+    
     def calculate_achievements(self, activities):
         """Calculate achievements based on activities"""
         achievements = []
@@ -378,13 +1142,12 @@ class StravaFetcher:
         # This would require more detailed analysis of activities
         
         # Save achievements
-        with open(ACHIEVEMENTS_FILE, 'w') as f:
-            json.dump(achievements, f)
+        dump_json(achievements, ACHIEVEMENTS_FILE)
         
         logger.info(f"Successfully calculated {len(achievements)} achievements")
         return achievements
     
-    def calculate_summary(self, activities):
+    def calculate_summary(self, activities, sketches=None):
         """Calculate summary statistics for dashboard"""
         summary = {
             'last_updated': datetime.now().isoformat(),
@@ -513,9 +1276,12 @@ class StravaFetcher:
                     'count': 0
                 }
         
+        # Add distribution quantiles from the streaming sketches
+        if sketches is not None:
+            summary['distributions'] = self.calculate_distributions(sketches)
+        
         # Save summary
-        with open(SUMMARY_FILE, 'w') as f:
-            json.dump(summary, f)
+        dump_json(summary, SUMMARY_FILE)
         
         logger.info("Successfully calculated summary statistics")
         return summary
@@ -684,13 +1450,11 @@ class StravaFetcher:
         
         # Add records to summary file
         try:
-            with open(SUMMARY_FILE, 'r') as f:
-                summary = json.load(f)
+            summary = load_json(SUMMARY_FILE)
             
             summary['records'] = records
             
-            with open(SUMMARY_FILE, 'w') as f:
-                json.dump(summary, f)
+            dump_json(summary, SUMMARY_FILE)
             
             logger.info("Successfully calculated personal records")
         except Exception as e:
@@ -698,6 +1462,94 @@ class StravaFetcher:
         
         return records
 
+def format_duration(seconds):
+    """Format a number of seconds as h:mm:ss"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+def format_record_value(record_type, name, value):
+    """Format a personal record value with its unit"""
+    if name.startswith('fastest'):
+        return format_duration(value)
+    if name == 'longest_distance':
+        # Swim distances are stored in meters, the others in km
+        return f"{value:.0f} m" if record_type == 'swim' else f"{value:.2f} km"
+    if name == 'most_elevation':
+        return f"{value:.0f} m"
+    if name == 'best_avg_power':
+        return f"{value:.0f} W"
+    return f"{value:.1f}"
+
+def format_totals(label, totals):
+    """Format distance, elevation, time and count totals as a single line"""
+    return (f"{label}: {totals['distance']:.1f} km, {totals['elevation_gain']:.0f} m elevation, "
+            f"{totals['moving_time']:.1f} h, {totals['count']} activities")
+
+def run_query(args):
+    """Answer a quick question from the snapshot of the last full run"""
+    snapshot = load_snapshot()
+    if snapshot is None:
+        print(f"No snapshot found at {SNAPSHOT_FILE}, run a full fetch first", file=sys.stderr)
+        return 1
+    
+    summary = snapshot['summary']
+    activity_type = args.type.lower() if args.type else None
+    
+    if args.question in ('month', 'week') and activity_type:
+        print(f"--type is not supported for the {args.question} query", file=sys.stderr)
+        return 1
+    
+    if args.question == 'year':
+        year = args.year or summary.get('current_year') or str(datetime.now().year)
+        result = summary['years'].get(year)
+        if result and activity_type:
+            result = result['activity_types'].get(activity_type)
+        label = f"{year} {activity_type}" if activity_type else year
+    elif args.question == 'totals':
+        result = summary['activity_types'].get(activity_type) if activity_type else summary['totals']
+        label = f"All-time {activity_type}" if activity_type else "All-time"
+    elif args.question == 'month':
+        result = summary.get('current_month')
+        label = f"Current month (as of {summary['last_updated'][:10]})"
+    elif args.question == 'week':
+        result = summary.get('current_week')
+        label = f"Last 7 days (as of {summary['last_updated'][:10]})"
+    elif args.question == 'records':
+        records = snapshot['records']
+        result = {activity_type: records.get(activity_type)} if activity_type else records
+    else:
+        distributions = summary.get('distributions', {})
+        year = args.year or 'all'
+        result = {
+            t: years[year][args.field]
+            for t, years in distributions.items()
+            if (not activity_type or t == activity_type) and args.field in years.get(year, {})
+        }
+    
+    if args.json:
+        print(json.dumps(result))
+        return 0
+    
+    if not result:
+        print("No matching activities")
+    elif args.question == 'records':
+        lines = [
+            f"{record_type} {name}: {format_record_value(record_type, name, record['value'])} "
+            f"({record['date'][:10]}, activity {record['activity_id']})"
+            for record_type, type_records in result.items()
+            for name, record in (type_records or {}).items()
+            if record
+        ]
+        print('\n'.join(lines) if lines else "No matching activities")
+    elif args.question == 'quantiles':
+        for quantile_type, stats in result.items():
+            quantiles = ', '.join(f"p{int(q * 100)} {stats[f'p{int(q * 100)}']:.2f}" for q in SKETCH_QUANTILES)
+            print(f"{quantile_type} {args.field} ({year}, {stats['count']} activities): {quantiles}")
+    else:
+        print(format_totals(label, result))
+    return 0
+
 def main():
     """Main function to run the Strava data fetcher"""
     parser = argparse.ArgumentParser(description='Fetch Strava activity data for dashboard')
@@ -705,10 +1557,34 @@ def main():
     parser.add_argument('--token', help='Path to token file', default=TOKEN_FILE)
     parser.add_argument('--limit', type=int, help='Limit number of activities to fetch', default=None)
     parser.add_argument('--detailed', action='store_true', help='Fetch detailed activity data')
+    parser.add_argument('--json-backend', choices=list(JSON_BACKENDS), help='JSON serializer backend', default=None)
+    parser.add_argument('--export', choices=EXPORT_FORMATS, action='append', help='Also export activities to a columnar format', default=[])
+    
+    subparsers = parser.add_subparsers(dest='command')
+    query_parser = subparsers.add_parser('query', help='Answer a quick question from the last run without fetching')
+    query_parser.add_argument('question', choices=QUERIES, help='What to report')
+    query_parser.add_argument('--year', help='Year to report (defaults to the current year, or all years for quantiles)', default=None)
+    query_parser.add_argument('--type', help='Activity type, e.g. ride or run', default=None)
+    query_parser.add_argument('--field', choices=SKETCH_FIELDS, help='Field for the quantiles query', default='average_speed')
+    query_parser.add_argument('--json', action='store_true', help='Print the raw result as JSON')
     args = parser.parse_args()
     
+    # Queries only read the snapshot, so skip logging setup and networking entirely
+    if args.command == 'query':
+        return run_query(args)
+    
+    configure_logging()
     logger.info("Starting Strava data fetcher")
     
+    try:
+        if args.json_backend:
+            set_json_backend(args.json_backend)
+        get_json_backend()
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    logger.info(f"Using {json_backend} JSON backend")
+    
     # Initialize fetcher
     fetcher = StravaFetcher(config_file=args.config, token_file=args.token)
     
@@ -740,8 +1616,14 @@ def main():
         
         if detailed_activities:
             activities = detailed_activities
-            with open(ACTIVITIES_FILE, 'w') as f:
-                json.dump(detailed_activities, f)
+            dump_json(detailed_activities, ACTIVITIES_FILE)
+    
+    # Export activity table to columnar formats
+    for fmt in args.export:
+        export_activities(activities, fmt)
+    
+    # Update quantile sketches with new activities
+    sketches = fetcher.update_sketches(activities)
     
     # Get featured activities
     featured_activities = fetcher.get_featured_activities()
@@ -749,15 +1631,21 @@ def main():
     # Process segments
     segments = fetcher.process_segments(activities)
     
+    # Aggregate heatmap tiles
+    heatmap = fetcher.aggregate_heatmap(activities)
+    
     # Calculate achievements
     achievements = fetcher.calculate_achievements(activities)
     
     # Calculate summary statistics
-    summary = fetcher.calculate_summary(activities)
+    summary = fetcher.calculate_summary(activities, sketches=sketches)
     
     # Calculate personal records
     records = fetcher.calculate_personal_records(activities)
     
+    # Write aggregate snapshot for fast queries
+    write_snapshot(summary, records)
+    
     logger.info("Strava data fetcher completed successfully")
     return 0
 